@@ -1,4 +1,5 @@
 import io
+import marshal
 import os
 import tempfile
 import textwrap
@@ -9,26 +10,17 @@ from unittest import mock
 
 class TestOptsParser(unittest.TestCase):
     def assertOptsEqual(self, expected: trashy_rm.ExecConfig, actual: trashy_rm.ExecConfig):
-        self.assertEqual(expected.force, actual.force)
-        self.assertEqual(expected.handle_dirs, actual.handle_dirs)
-        self.assertEqual(expected.recursive, actual.recursive)
-        self.assertEqual(expected.interactive_mode, actual.interactive_mode)
-        self.assertEqual(expected.verbose, actual.verbose)
-        self.assertEqual(expected.help, actual.help)
-        self.assertEqual(expected.get_trash, actual.get_trash)
-        self.assertEqual(expected.trash_mode, actual.trash_mode)
-        self.assertEqual(expected.shred, actual.shred)
-        self.assertCountEqual(expected.targets, actual.targets)
+        self.assertEqual(expected, actual)
 
     def test_opts1(self):
-        expected = trashy_rm.ExecConfig()
-        expected.recursive = True
-        expected.trash_mode = trashy_rm.TrashMode.ALWAYS
-        expected.interactive_mode = trashy_rm.InteractiveMode.ALWAYS
-        expected.verbose = True
-        expected.handle_dirs = True
-        expected.read_targets = True
-        expected.targets = ['target1', '/dir/there/target2', '-target3', '--help']
+        expected = trashy_rm.ExecConfig(
+            recursive=True,
+            trash_mode=trashy_rm.TrashMode.ALWAYS,
+            interactive_mode=trashy_rm.InteractiveMode.ALWAYS,
+            verbose=True,
+            handle_dirs=True,
+            read_targets=True,
+            targets=('target1', '/dir/there/target2', '-target3', '--help'))
         opts = [
             '--recursive',
             '--recycle',
@@ -45,10 +37,10 @@ class TestOptsParser(unittest.TestCase):
         self.assertOptsEqual(expected, actual)
 
     def test_opts2(self):
-        expected = trashy_rm.ExecConfig()
-        expected.interactive_mode = trashy_rm.InteractiveMode.NEVER
-        expected.force = True
-        expected.help = True
+        expected = trashy_rm.ExecConfig(
+            interactive_mode=trashy_rm.InteractiveMode.NEVER,
+            force=True,
+            help=True)
         opts = [
             '--interactive=never',
             '--force',
@@ -57,6 +49,24 @@ class TestOptsParser(unittest.TestCase):
         actual = trashy_rm.parse_opts(opts)
         self.assertOptsEqual(expected, actual)
 
+    def test_opts_not_shared(self):
+        # Targets from one parse must not leak into the next
+        self.assertEqual(('target1',), trashy_rm.parse_opts(['target1']).targets)
+        self.assertEqual(('target2',), trashy_rm.parse_opts(['target2']).targets)
+        self.assertEqual((), trashy_rm.ExecConfig().targets)
+
+    def test_iter_targets(self):
+        inp = io.StringIO('target3\n\ntarget 4\n')
+        self.assertEqual(['target1', 'target2'],
+                         list(trashy_rm.parse_opts(['target1', 'target2']).iter_targets(inp)))
+        self.assertEqual(['target1', 'target2', 'target3', 'target 4'],
+                         list(trashy_rm.parse_opts(['target1', '-', 'target2']).iter_targets(inp)))
+
+    def test_opts_cached(self):
+        # Repeated parses of the same arguments share one result
+        opts = ['-rf', 'target1']
+        self.assertIs(trashy_rm.parse_opts(opts), trashy_rm.parse_opts(list(opts)))
+
     def test_bad_opts1(self):
         # Unrecognized short option '-'
         opts = [
@@ -82,8 +92,20 @@ class TestOptsParser(unittest.TestCase):
         self.assertRaises(trashy_rm.OptParseError, lambda: trashy_rm.parse_opts(opts))
         self.assertRaises(trashy_rm.OptParseError, lambda: trashy_rm.parse_opts(opts[::-1]))
 
+    def test_bad_opts_message(self):
+        # Errors name the offending option the way rm does
+        self.assertRaisesRegex(trashy_rm.OptParseError, "unrecognized option '--what'",
+                               lambda: trashy_rm.parse_opts(['--what']))
+        self.assertRaisesRegex(trashy_rm.OptParseError, "invalid option -- 'w'",
+                               lambda: trashy_rm.parse_opts(['-fw']))
+        self.assertRaisesRegex(trashy_rm.OptParseError, "invalid argument 'squirrels' for '--interactive'",
+                               lambda: trashy_rm.parse_opts(['--interactive=squirrels']))
+
 
 class TestConfig(unittest.TestCase):
+    def setUp(self):
+        trashy_rm.load_app_config.cache_clear()
+
     @mock.patch.dict(os.environ, {'HOME': '/tmp/trashy/my$PWD',
                                   'MY_DIR': '/tmp/trashy/test',
                                   'SPACES_DIR': '/tmp/trashy/spa ces'})
@@ -129,17 +151,198 @@ class TestConfig(unittest.TestCase):
                              '/tmp/trashy/spa ces-here/dir',
                              '$UNSET/tmp/stuff']
             self.assertCountEqual(expected_dirs, config.trashy_dirs)
+            # Unchanged files are served from the cache
+            self.assertIs(config, trashy_rm.load_app_config([f.name for f in config_files]))
+            # Unless the environment the paths were expanded with changed
+            with mock.patch.dict(os.environ, {'MY_DIR': '/tmp/trashy/changed'}):
+                config = trashy_rm.load_app_config([f.name for f in config_files])
+                self.assertIn('/tmp/trashy/changed/directory', config.trashy_dirs)
+
+    @mock.patch.dict(os.environ, {'HOME': '/tmp/trashy/home', 'DL': '~/Downloads', 'USER': 'root'})
+    def test_expand_path(self):
+        # Expands like os.path.expanduser(os.path.expandvars(path))
+        for path in ['$DL/x', '~$USER/x', '~/$DL', '${DL}', '$UNSET/x', '${}/$', 'a~/b', '/plain/path']:
+            self.assertEqual(os.path.expanduser(os.path.expandvars(path)), trashy_rm._expand_path(path))
+        self.assertEqual('/tmp/trashy/home/Downloads/x', trashy_rm._expand_path('$DL/x'))
+
+    def test_in_trashy_dir(self):
+        config = trashy_rm.AppConfig(trashy_dirs=['/tmp/trashy/test/', '/tmp/trashy/other/../spa ces'])
+        self.assertEqual(('/tmp/trashy/test', '/tmp/trashy/spa ces'), config.trashy_dirs)
+        self.assertTrue(config.in_trashy_dir('/tmp/trashy/test'))
+        self.assertTrue(config.in_trashy_dir('/tmp/trashy/test/dir/file'))
+        self.assertTrue(config.in_trashy_dir('/tmp/trashy/spa ces/./file'))
+        self.assertFalse(config.in_trashy_dir('/tmp/trashy/testing'))
+        self.assertFalse(config.in_trashy_dir('/tmp/trashy'))
+        self.assertFalse(config.in_trashy_dir('/'))
+
+    def test_in_trashy_dir_relative(self):
+        config = trashy_rm.AppConfig(trashy_dirs=['rel/dir', ''])
+        self.assertEqual(('rel/dir',), config.trashy_dirs)
+        self.assertTrue(config.in_trashy_dir('rel/dir/x'))
+        self.assertTrue(config.in_trashy_dir(os.path.join(os.getcwd(), 'rel', 'dir')))
+        self.assertFalse(config.in_trashy_dir('rel'))
+        self.assertFalse(config.in_trashy_dir('.'))
+        self.assertEqual((), trashy_rm.AppConfig(trashy_dirs=None).trashy_dirs)
+
+    def test_config_cache_cwd(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            old_cwd = os.getcwd()
+            config_file = os.path.join(tmp_dir, 'config')
+            with open(config_file, 'w') as f:
+                f.write('[trash_path]\nx = rel\n')
+            os.mkdir(os.path.join(tmp_dir, 'a'))
+            os.mkdir(os.path.join(tmp_dir, 'b'))
+            try:
+                os.chdir(os.path.join(tmp_dir, 'a'))
+                trashy_rm.load_app_config([config_file])
+                # Relative trash dirs are resolved against the new working dir, not the cached one
+                os.chdir(os.path.join(tmp_dir, 'b'))
+                config = trashy_rm.load_app_config([config_file])
+                self.assertTrue(config.in_trashy_dir('rel/f'))
+                self.assertFalse(config.in_trashy_dir(os.path.join(tmp_dir, 'a', 'rel', 'f')))
+            finally:
+                os.chdir(old_cwd)
+
+    def test_config_cache_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file = os.path.join(tmp_dir, 'config')
+            cache_file = os.path.join(tmp_dir, 'cache', 'config.cache')
+            with open(config_file, 'w') as f:
+                f.write('[prompt]\ncutoff = 7\n')
+            self.assertEqual(7, trashy_rm.load_app_config([config_file], cache_file).cutoff)
+            self.assertTrue(os.path.isfile(cache_file))
+            # The cached sections are only used while the config file is unchanged
+            parser = trashy_rm.FastConfigParser()
+            key = ((config_file, trashy_rm._config_stat(config_file)),)
+            self.assertTrue(parser.read_cache(cache_file, key))
+            self.assertEqual(7, parser.getint('prompt', 'cutoff'))
+            # Sections cached by another version of the parser are not used
+            with mock.patch.object(trashy_rm, '_CONFIG_CACHE_VERSION', trashy_rm._CONFIG_CACHE_VERSION + 1):
+                self.assertFalse(trashy_rm.FastConfigParser().read_cache(cache_file, key))
+            with open(config_file, 'w') as f:
+                f.write('[prompt]\ncutoff = 12\n')
+            self.assertEqual(12, trashy_rm.load_app_config([config_file], cache_file).cutoff)
+
+    def test_config_cache_bad_shape(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_file = os.path.join(tmp_dir, 'config.cache')
+            for sections in [['prompt'], {'prompt': ['cutoff']}, {'prompt': {'cutoff': 4}}]:
+                with open(cache_file, 'wb') as f:
+                    marshal.dump((trashy_rm._CONFIG_CACHE_VERSION, (), sections), f)
+                self.assertFalse(trashy_rm.FastConfigParser().read_cache(cache_file, ()))
+            with open(cache_file, 'wb') as f:
+                f.write(b'garbage')
+            self.assertFalse(trashy_rm.FastConfigParser().read_cache(cache_file, ()))
+
+    def test_config_cache_write_failure(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_file = os.path.join(tmp_dir, 'config.cache')
+            parser = trashy_rm.FastConfigParser()
+            with mock.patch('marshal.dump', side_effect=OSError(28, 'No space left on device')):
+                parser.write_cache(cache_file, ())
+            # The failed write leaves nothing behind
+            self.assertEqual([], os.listdir(tmp_dir))
+
+    def test_config_cache_file_unused(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file = os.path.join(tmp_dir, 'config')
+            cache_file = os.path.join(tmp_dir, 'config.cache')
+            # No cache for missing config files
+            self.assertEqual(trashy_rm.DEFAULT_CUTOFF, trashy_rm.load_app_config([config_file], cache_file).cutoff)
+            self.assertFalse(os.path.exists(cache_file))
+            # Nor one written when asked not to update it
+            with open(config_file, 'w') as f:
+                f.write('[prompt]\ncutoff = 7\n')
+            self.assertEqual(7, trashy_rm.load_app_config([config_file], cache_file, update_cache=False).cutoff)
+            self.assertFalse(os.path.exists(cache_file))
+
+    def test_fast_config_parser(self):
+        parser = trashy_rm.FastConfigParser()
+        parser.read_string(textwrap.dedent("""
+            # Comment
+            [prompt]
+            ; Another comment
+            CutOff: 4
+            [trash_path]
+            home = ~/with = sign
+            """))
+        self.assertEqual(4, parser.getint('prompt', 'cutoff'))
+        self.assertIsNone(parser.getint('missing', 'cutoff'))
+        self.assertFalse(parser.has_section('missing'))
+        self.assertEqual([('home', '~/with = sign')], parser.items('trash_path'))
+
+    def test_fast_config_parser_read(self):
+        with tempfile.NamedTemporaryFile('wb') as config:
+            config.write(b'[prompt]\r\ncutoff = 4\r\n[trash_path]\r\nhome = /x\xff\r\n')
+            config.flush()
+            parser = trashy_rm.FastConfigParser()
+            self.assertEqual([config.name], parser.read([config.name, config.name + '.missing']))
+        self.assertEqual(4, parser.getint('prompt', 'cutoff'))
+        self.assertEqual([('home', '/x\ufffd')], parser.items('trash_path'))
+
+    def test_fast_config_parser_lines(self):
+        # Entries never run across lines
+        parser = trashy_rm.FastConfigParser()
+        parser.read_string(textwrap.dedent("""
+            [prompt] ; trailing comment
+            cutoff = 6
+            [trash_path]
+            empty =
+            home = ~/x
+            stray line
+            other = /x
+            """))
+        self.assertEqual(6, parser.getint('prompt', 'cutoff'))
+        self.assertEqual([('empty', ''), ('home', '~/x'), ('other', '/x')], parser.items('trash_path'))
+
+
+class TestSystemInfo(unittest.TestCase):
+    def setUp(self):
+        trashy_rm.LinuxSystemInfo.get_shredder.cache_clear()
+
+    def tearDown(self):
+        trashy_rm.LinuxSystemInfo.get_shredder.cache_clear()
+
+    @mock.patch.dict(os.environ, {'XDG_CONFIG_HOME': '/tmp/trashy/nonexistent',
+                                  'XDG_DATA_HOME': '/tmp/trashy/data'})
+    def test_system_info(self):
+        trashy_rm.LinuxSystemInfo.get_configs.cache_clear()
+        trashy_rm.LinuxSystemInfo.get_user_trash.cache_clear()
+        sys_info = trashy_rm.LinuxSystemInfo()
+        self.assertEqual(os.getuid(), sys_info.uid)
+        self.assertEqual([], sys_info.configs)
+        self.assertEqual('/tmp/trashy/data/Trash', sys_info.user_trash)
+        trashy_rm.LinuxSystemInfo.get_user_trash.cache_clear()
+        with mock.patch.dict(os.environ, {'XDG_DATA_HOME': '', 'HOME': '/tmp/trashy/home'}):
+            # Empty XDG variables fall back to the default
+            self.assertEqual('/tmp/trashy/home/.local/share/Trash', sys_info.user_trash)
+        trashy_rm.LinuxSystemInfo.get_user_trash.cache_clear()
+        with mock.patch.dict(os.environ, {'XDG_DATA_HOME': '/tmp/trashy/data/'}):
+            self.assertEqual('/tmp/trashy/data/Trash', sys_info.user_trash)
+        trashy_rm.LinuxSystemInfo.get_configs.cache_clear()
+        trashy_rm.LinuxSystemInfo.get_user_trash.cache_clear()
+
+    def test_get_system_info(self):
+        self.assertIs(trashy_rm.get_system_info(), trashy_rm.get_system_info())
+
+    def test_get_shredder(self):
+        paths = {'shred': '/usr/bin/shred', 'gshred': '/opt/bin/gshred'}
+        with mock.patch('shutil.which', paths.get):
+            self.assertEqual('shred', trashy_rm.LinuxSystemInfo.get_shredder())
+        trashy_rm.LinuxSystemInfo.get_shredder.cache_clear()
+        del paths['shred']
+        with mock.patch('shutil.which', paths.get):
+            self.assertEqual('gshred', trashy_rm.LinuxSystemInfo.get_shredder())
+        trashy_rm.LinuxSystemInfo.get_shredder.cache_clear()
+        with mock.patch('shutil.which', lambda name: None):
+            self.assertIsNone(trashy_rm.LinuxSystemInfo.get_shredder())
 
 
 class TestHarness(unittest.TestCase):
     def test_help(self):
         sys_info = trashy_rm.get_system_info()
         app_config = trashy_rm.AppConfig()
-        exec_config = trashy_rm.ExecConfig()
-        exec_config.force = True
-        exec_config.shred = True
-        exec_config.verbose = True
-        exec_config.help = True
+        exec_config = trashy_rm.ExecConfig(force=True, shred=True, verbose=True, help=True)
         inp = io.StringIO()
         out = io.StringIO()
         err = io.StringIO()
@@ -147,6 +350,16 @@ class TestHarness(unittest.TestCase):
         self.assertEqual(trashy_rm.__doc__, out.getvalue())
         self.assertEqual('', err.getvalue())
 
+    def test_get_trash(self):
+        sys_info = trashy_rm.get_system_info()
+        exec_config = trashy_rm.ExecConfig(get_trash=True)
+        inp = io.StringIO()
+        out = io.StringIO()
+        err = io.StringIO()
+        self.assertEqual(0, trashy_rm.run(sys_info, trashy_rm.AppConfig(), exec_config, inp, out, err))
+        self.assertEqual(sys_info.user_trash + '\n', out.getvalue())
+        self.assertEqual('', err.getvalue())
+
 
 if __name__ == '__main__':
     unittest.main()
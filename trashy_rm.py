@@ -51,25 +51,23 @@ See man trashy_rm(1) for configuration information
 # provides different interactive modes to get a preview of what files will be
 # affected.
 
-import configparser
+import functools
 import os
-import platform
+import re
 import sys
-from enum import Enum
-from subprocess import call
-
-from typing import List
+from collections.abc import Iterator
+from enum import IntEnum
 
 DEFAULT_CUTOFF = 3
 
 
-class InteractiveMode(Enum):
+class InteractiveMode(IntEnum):
     NEVER = 1
     NORMAL = 2
     ALWAYS = 3
 
 
-class TrashMode(Enum):
+class TrashMode(IntEnum):
     """Mode for trashing / recycling files
     NORMAL will move items to trash if they are in a trash dir specified in the
     config, otherwise normal rm will be used
@@ -81,121 +79,377 @@ class TrashMode(Enum):
 
 class AppConfig:
     """Defines the configuration of trashy_rm itself"""
+    __slots__ = ('cutoff', 'trashy_dirs', '_trashy_set')
+
     def __init__(self, cutoff=DEFAULT_CUTOFF, trashy_dirs=None):
         # number of files / dirs to remove before a prompt is given
-        if trashy_dirs is None:
-            trashy_dirs = list()
         self.cutoff = cutoff
-        # directories in which to default to trash instead of rm
-        self.trashy_dirs = trashy_dirs
+        # directories in which to default to trash instead of rm, empty entries don't name a directory
+        self.trashy_dirs = tuple(os.path.normpath(d) for d in trashy_dirs or () if d)
+        # Made absolute like the targets checked against them, relative entries resolve against the working dir
+        self._trashy_set = frozenset(map(os.path.abspath, self.trashy_dirs))
+
+    def in_trashy_dir(self, path: str) -> bool:
+        """Whether the path is, or is inside, one of the trashy dirs"""
+        # Walk up the parents with a set lookup each, rather than comparing against every trashy dir
+        path = os.path.abspath(path)
+        while path not in self._trashy_set:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+        return True
 
 
 class ExecConfig:
-    """Defines the configuration for this trashy_rm execution"""
-    # Show help prompt and exit
-    help = False
-    # Return the current trash dir and exit
-    get_trash = False
-    # get version and exit
-    version = False
-    # Never prompt, ignore non-existent files and arguments
-    force = False
-    # Prompt mode (never, once / normal, or always
-    interactive_mode = InteractiveMode.NORMAL
-    # handle empty directories
-    handle_dirs = False
-    # Recurse though directories
-    recursive = False
-    # Root preservation (off, /, all) not supported at this time
-    # preservation = None
-    # Verbosity
-    verbose = False
-    # Enable trash / recycle mode (default is to recycle items in the configured dirs, rm elsewhere)
-    trash_mode = TrashMode.NORMAL
-    # Shred (overrides recycle)
-    shred = False
-    # Dry run, do not modify the file system
-    dry_run = False
-    # Read targets from the input stream
-    read_targets = False
-    # target files / dirs
-    targets = []
+    """Defines the configuration for this trashy_rm execution, immutable once created"""
+    # Options and their defaults. Written out by hand rather than as a dataclass, importing dataclasses would
+    # pull inspect into every startup
+    _DEFAULTS = {
+        # Show help prompt and exit
+        'help': False,
+        # Return the current trash dir and exit
+        'get_trash': False,
+        # get version and exit
+        'version': False,
+        # Never prompt, ignore non-existent files and arguments
+        'force': False,
+        # Prompt mode (never, once / normal, or always
+        'interactive_mode': InteractiveMode.NORMAL,
+        # handle empty directories
+        'handle_dirs': False,
+        # Recurse though directories
+        'recursive': False,
+        # Root preservation (off, /, all) not supported at this time
+        # 'preservation': None,
+        # Verbosity
+        'verbose': False,
+        # Enable trash / recycle mode (default is to recycle items in the configured dirs, rm elsewhere)
+        'trash_mode': TrashMode.NORMAL,
+        # Shred (overrides recycle)
+        'shred': False,
+        # Dry run, do not modify the file system
+        'dry_run': False,
+        # Read targets from the input stream
+        'read_targets': False,
+        # target files / dirs
+        'targets': (),
+    }
+    __slots__ = tuple(_DEFAULTS)
+
+    def __init__(self, **kwargs):
+        unknown = kwargs.keys() - self._DEFAULTS.keys()
+        if unknown:
+            raise TypeError('ExecConfig got unexpected keyword arguments: ' + ', '.join(sorted(unknown)))
+        for name, default in self._DEFAULTS.items():
+            object.__setattr__(self, name, kwargs.get(name, default))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ExecConfig is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ExecConfig is immutable')
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return 'ExecConfig(' + ', '.join(name + '=' + repr(getattr(self, name)) for name in self.__slots__) + ')'
+
+    def iter_targets(self, inp) -> Iterator[str]:
+        """Iterate over the targets, followed by those read line by line from inp when read_targets is set"""
+        yield from self.targets
+        if self.read_targets:
+            for line in inp:
+                # Skip blank lines, e.g. a trailing newline, rather than yielding an empty path
+                target = line.rstrip('\n')
+                if target:
+                    yield target
+
+
+# Version of the FastConfigParser cache format and parsing rules, bump it whenever either changes so cached
+# sections from an older version are parsed again
+_CONFIG_CACHE_VERSION = 1
+
+
+class FastConfigParser:
+    """Minimal INI parser covering the trashy_rm config format
+
+    Only supports flat 'key = value' (or 'key: value') lines grouped under '[section]' headers and whole
+    line '#' / ';' comments, any other line is ignored. Option names are lower-cased and later files override
+    earlier ones, matching the configparser behavior we relied on.
+    """
+    # Both patterns are kept to a single line, anything after a section header's ']' is ignored like configparser
+    _SECTION_RE = re.compile(r'^[ \t]*\[([^\]\n]+)\][^\n]*$', re.M)
+    _KV_RE = re.compile(r'^[ \t]*([^=:;#\s][^=:\n]*?)[ \t]*[=:][ \t]*([^\n]*?)[ \t]*$', re.M)
+
+    def __init__(self):
+        self._sections = dict()
+
+    def read(self, file_names) -> list[str]:
+        """Read and parse the given file(s), silently ignoring any that can't be opened"""
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        read_ok = []
+        for file_name in file_names:
+            try:
+                with open(file_name, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            # Decode as UTF-8 regardless of locale, a stray bad byte shouldn't make the whole config unusable. Line
+            # endings are normalized here since binary mode doesn't translate them, and the patterns only match '\n'
+            self.read_string('\n'.join(data.decode('utf-8', 'replace').splitlines()))
+            read_ok.append(file_name)
+        return read_ok
+
+    def read_string(self, string: str):
+        # Splitting on the section headers yields [preamble, name, body, name, body, ...]
+        parts = self._SECTION_RE.split(string)
+        for name, body in zip(parts[1::2], parts[2::2]):
+            section = self._sections.setdefault(name.strip(), dict())
+            section.update((key.lower(), value) for key, value in self._KV_RE.findall(body))
+
+    def read_cache(self, cache_file: str, fingerprint: tuple) -> bool:
+        """Load the sections saved by write_cache if they were saved by this version with the same fingerprint"""
+        # marshal is builtin, so reading the cache adds no import cost. It isn't secure against erroneous or
+        # malicious data though, so anything that doesn't load as the expected sections counts as a cache miss
+        import marshal
+        try:
+            with open(cache_file, 'rb') as f:
+                version, cached_fingerprint, sections = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        if version != _CONFIG_CACHE_VERSION or cached_fingerprint != fingerprint:
+            return False
+        if not self._valid_sections(sections):
+            return False
+        self._sections = sections
+        return True
+
+    @staticmethod
+    def _valid_sections(sections) -> bool:
+        """Whether sections has the {section: {option: value}} shape of parsed strings"""
+        return isinstance(sections, dict) and all(
+            isinstance(name, str) and isinstance(section, dict)
+            and all(isinstance(k, str) and isinstance(v, str) for k, v in section.items())
+            for name, section in sections.items())
+
+    def write_cache(self, cache_file: str, fingerprint: tuple):
+        """Save the parsed sections to cache_file, failures just mean the files get parsed again next time"""
+        import marshal
+        import tempfile
+        cache_dir = os.path.dirname(cache_file)
+        tmp_name = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=cache_dir, delete=False) as f:
+                tmp_name = f.name
+                marshal.dump((_CONFIG_CACHE_VERSION, fingerprint, self._sections), f)
+            os.replace(tmp_name, cache_file)
+        except OSError:
+            # Don't leave a partial temporary file behind, whichever step failed
+            if tmp_name is not None:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+
+    def has_section(self, section: str) -> bool:
+        return section in self._sections
+
+    def items(self, section: str) -> list[tuple]:
+        return list(self._sections[section].items())
+
+    def getint(self, section: str, option: str, fallback=None):
+        value = self._sections.get(section, {}).get(option.lower())
+        return fallback if value is None else int(value)
+
+
+# Matches '$VAR' and '${VAR}' like os.path.expandvars
+_VAR_RE = re.compile(r'\$(\w+)|\$\{([^}]*)\}', re.ASCII)
+
+
+def _expand_var(m) -> str:
+    """Substitution for _VAR_RE; like os.path.expandvars, unset vars are kept as-is"""
+    return os.environ.get(m.group(1) or m.group(2), m.group(0))
+
+
+def _expand_path(path: str) -> str:
+    """Expand any $VAR / ${VAR} in the path, then a leading ~ / ~user
+
+    Same order as os.path.expanduser(os.path.expandvars(path)), so a var holding '~/dir' is tilde expanded as well
+    """
+    if '$' in path:
+        path = _VAR_RE.sub(_expand_var, path)
+    if path[:1] == '~':
+        path = os.path.expanduser(path)
+    return path
+
+
+# Loaded app configs keyed by the fingerprints of their config files. Each entry also records the environment
+# variables its trash paths were expanded with, and the working dir if any is relative, so a changed environment
+# isn't served a stale config
+_CONFIG_CACHE = {}
+
+
+def _config_stat(file_name: str) -> tuple | None:
+    """Modification time and size of the config file, or None if it doesn't exist"""
+    try:
+        st = os.stat(file_name)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
 
-def load_app_config(file_names: List[str]) -> AppConfig:
-    parser = configparser.ConfigParser()
-    conf = AppConfig()
-    for file_name in file_names:
-        parser.read(file_name)
-    cutoff = parser.getint('prompt', 'cutoff', fallback=None)
-    if cutoff is not None:
-        conf.cutoff = cutoff
+def load_app_config(file_names: list[str], cache_file: str | None = None, update_cache: bool = True) -> AppConfig:
+    """Load the app config from the given files
+
+    If cache_file is given and any of the files exist, the parsed files are also cached on disk there unless
+    TRASHY_RM_NOCACHE is set. With update_cache False, e.g. for a dry run, the cache file is only read, never written
+    """
+    key = tuple((name, _config_stat(name)) for name in file_names)
+    cached = _CONFIG_CACHE.get(key)
+    if cached is not None:
+        env_names, env_values, cwd, conf = cached
+        if tuple(map(os.environ.get, env_names)) == env_values and (cwd is None or cwd == os.getcwd()):
+            return conf
+    if os.environ.get('TRASHY_RM_NOCACHE') or all(st is None for _, st in key):
+        # Without any config files there is nothing to parse, the cache would only add I/O
+        cache_file = None
+    parser = FastConfigParser()
+    if not (cache_file and parser.read_cache(cache_file, key)):
+        # Files that failed to stat are never opened
+        parser.read([name for name, st in key if st is not None])
+        if cache_file and update_cache:
+            parser.write_cache(cache_file, key)
+    cutoff = parser.getint('prompt', 'cutoff', fallback=DEFAULT_CUTOFF)
+    trashy_dirs = []
+    # HOME is used for expanding ~, plus whatever vars the trash paths reference
+    env_names = {'HOME'}
     if parser.has_section('trash_path'):
-        conf.trashy_dirs += [os.path.expanduser(os.path.expandvars(path)) for _, path in parser.items('trash_path')]
+        paths = [path for _, path in parser.items('trash_path')]
+        trashy_dirs = [_expand_path(path) for path in paths]
+        env_names.update(a or b for path in paths for a, b in _VAR_RE.findall(path))
+    conf = AppConfig(cutoff, trashy_dirs)
+    env_names = tuple(env_names)
+    # Relative trash dirs were resolved against the current working dir, which must match too
+    cwd = None if all(map(os.path.isabs, conf.trashy_dirs)) else os.getcwd()
+    _CONFIG_CACHE[key] = env_names, tuple(map(os.environ.get, env_names)), cwd, conf
     return conf
 
 
+load_app_config.cache_clear = _CONFIG_CACHE.clear
+
+
 class OptParseError(Exception):
     """Exception indicating an invalid command line argument"""
 
 
-def parse_opts(opts: List[str]) -> ExecConfig:
+# Short option characters and whole long options mapped to the ExecConfig attribute and value they set. Keys
+# are interned so lookups of interned long options hit the identity fast path
+_OPT_ACTIONS = {sys.intern(k): v for k, v in {
+    # Standard rm args
+    'f': ('force', True),
+    '--force': ('force', True),
+    'd': ('handle_dirs', True),
+    '--dir': ('handle_dirs', True),
+    'r': ('recursive', True),
+    '--recursive': ('recursive', True),
+    'v': ('verbose', True),
+    '--verbose': ('verbose', True),
+    'i': ('interactive_mode', InteractiveMode.ALWAYS),
+    '--interactive': ('interactive_mode', InteractiveMode.ALWAYS),
+    'I': ('interactive_mode', InteractiveMode.NORMAL),
+    # TODO: preserve-root flags?
+    # trashy_rm args
+    'c': ('trash_mode', TrashMode.ALWAYS),
+    '--recycle': ('trash_mode', TrashMode.ALWAYS),
+    '--direct': ('trash_mode', TrashMode.NEVER),
+    's': ('shred', True),
+    '--shred': ('shred', True),
+    '--dryrun': ('dry_run', True),
+    'h': ('help', True),
+    '--help': ('help', True),
+    '--get-trash': ('get_trash', True),
+}.items()}
+
+# ExecConfig attributes whose options stop any further processing
+_STOP_ATTRS = frozenset(('help', 'get_trash'))
+
+# Accepted WHEN values for --interactive=WHEN
+_INTERACTIVE_MAP = {
+    'always': InteractiveMode.ALWAYS,
+    'yes': InteractiveMode.ALWAYS,
+    'once': InteractiveMode.NORMAL,
+    'never': InteractiveMode.NEVER,
+    'no': InteractiveMode.NEVER,
+    'none': InteractiveMode.NEVER,
+}
+
+
+def parse_opts(opts: list[str]) -> ExecConfig:
     """Parse command line arguments"""
-    conf = ExecConfig()
-    it = iter(opts)
-    while True:
-        try:
-            opt = next(it)
-            if opt == '--':
-                # Everything after this is a file
-                conf.targets += it
-            elif opt == '-':
-                # We should read targets from the input stream as well
-                conf.read_targets = True
-            elif not opt.startswith('-'):
-                conf.targets.append(opt)
+    return _parse_opts(tuple(opts))
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_opts(opts: tuple[str, ...]) -> ExecConfig:
+    # ExecConfig is frozen, so parse results for identical arguments can be shared
+    flags = dict()
+    targets = []
+    targets_append = targets.append
+    done = False
+    for i, opt in enumerate(opts):
+        if opt == '--':
+            # Everything after this is a file, take them in one slice
+            targets.extend(opts[i + 1:])
+            break
+        elif opt == '-':
+            # We should read targets from the input stream as well
+            flags['read_targets'] = True
+        elif opt[:1] != '-':
+            targets_append(opt)
+        elif opt[:2] == '--':
+            # Long options are looked up whole
+            action = _OPT_ACTIONS.get(sys.intern(opt))
+            if action:
+                attr, value = action
+                flags[attr] = value
+                if attr in _STOP_ATTRS:
+                    # Stop processing if we see a help or get-trash flag
+                    break
+            elif opt.startswith('--interactive='):
+                _, _, when = opt.partition('=')
+                mode = _INTERACTIVE_MAP.get(when)
+                if mode is None:
+                    raise OptParseError('trashy_rm: invalid argument \'' + when + '\' for \'--interactive\'')
+                flags['interactive_mode'] = mode
             else:
-                # Start by removing the leading '-' and splitting short opts into a list of characters
-                for o in [opt[1:]] if opt.startswith('--') else list(opt[1:]):
-                    # Handle the standard rm args first
-                    if o == 'f' or o == '-force':
-                        conf.force = True
-                    elif o == 'd' or o == '-dir':
-                        conf.handle_dirs = True
-                    elif o == 'r' or o == '-recursive':
-                        conf.recursive = True
-                    elif o == 'v' or o == '-verbose':
-                        conf.verbose = True
-                    elif o == 'i' or o == '-interactive' or o == '-interactive=always' or o == '-interactive=yes':
-                        conf.interactive_mode = InteractiveMode.ALWAYS
-                    elif o == 'I' or o == '-interactive=once':
-                        conf.interactive_mode = InteractiveMode.NORMAL
-                    elif o == '-interactive=never' or o == '-interactive=no' or o == '-interactive=none':
-                        conf.interactive_mode = InteractiveMode.NEVER
-                    # TODO: preserve-root flags?
-                    # Handle trashy_rm args
-                    elif o == 'h' or o == '-help':
-                        # Stop processing if we see a help flag
-                        conf.help = True
-                        raise StopIteration()
-                    elif o == '-get-trash':
-                        # Stop processing if we see a get-trash flag
-                        conf.get_trash = True
-                        raise StopIteration()
-                    elif o == 'c' or o == '-recycle':
-                        conf.trash_mode = TrashMode.ALWAYS
-                    elif o == '-direct':
-                        conf.trash_mode = TrashMode.NEVER
-                    elif o == 's' or o == '-shred':
-                        conf.shred = True
-                    elif o == '-dryrun':
-                        conf.dry_run = True
-                        # sys.stderr.write('Dry Run. Not actually removing files.\n\n')
-                    else:
-                        raise OptParseError('careful_rm: invalid option -- \'' + o + '\'')
-        except StopIteration:
+                raise OptParseError('trashy_rm: unrecognized option \'' + opt + '\'')
+        else:
+            # Short opts are iterated as characters, which CPython already caches so they need no interning
+            for o in opt[1:]:
+                action = _OPT_ACTIONS.get(o)
+                if action is None:
+                    raise OptParseError('trashy_rm: invalid option -- \'' + o + '\'')
+                attr, value = action
+                flags[attr] = value
+                if attr in _STOP_ATTRS:
+                    # Stop processing if we see a help or get-trash flag
+                    done = True
+                    break
+        if done:
             break
-    return conf
+    return ExecConfig(targets=tuple(targets), **flags)
 
 
 class UnsupportedSystemError(Exception):
@@ -203,45 +457,68 @@ class UnsupportedSystemError(Exception):
 
 
 class LinuxSystemInfo:
-    def __int__(self):
+    __slots__ = ('uid',)
+
+    def __init__(self):
         self.uid = os.getuid()
-        self.configs = LinuxSystemInfo.get_configs()
-        self.user_trash = LinuxSystemInfo.get_user_trash()
-        self.shredder = LinuxSystemInfo.get_shredder()
+
+    # The remaining system info is looked up lazily, only when needed, and memoized by the get_* classmethods
+    @property
+    def configs(self) -> list[str]:
+        return self.get_configs()
+
+    @property
+    def user_trash(self) -> str:
+        return self.get_user_trash()
+
+    @property
+    def shredder(self) -> str:
+        return self.get_shredder()
+
+    @property
+    def config_cache(self) -> str:
+        return self.get_config_cache()
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def get_user_trash(cls) -> str:
-        xdg_data_home = os.path.expanduser(os.path.expandvars(os.getenv('XDG_DATA_HOME', '~/.local/share')))
-        user_trash = os.path.join(xdg_data_home, 'Trash')
+        # An empty XDG variable is treated as unset, as the XDG base directory spec requires
+        xdg_data_home = _expand_path(os.getenv('XDG_DATA_HOME') or '~/.local/share').rstrip('/')
+        user_trash = f'{xdg_data_home}/Trash'
         return user_trash
 
     @classmethod
-    def get_configs(cls) -> List[str]:
-        xdg_config_home = os.path.expanduser(os.path.expandvars(os.getenv('XDG_CONFIG_HOME', '~/.config')))
-        user_config = os.path.join(xdg_config_home, 'trashy_rm', 'config')
+    @functools.lru_cache(maxsize=1)
+    def get_configs(cls) -> list[str]:
+        xdg_config_home = _expand_path(os.getenv('XDG_CONFIG_HOME') or '~/.config').rstrip('/')
+        user_config = f'{xdg_config_home}/trashy_rm/config'
         return [user_config] if os.path.isfile(user_config) else []
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
+    def get_config_cache(cls) -> str:
+        xdg_cache_home = _expand_path(os.getenv('XDG_CACHE_HOME') or '~/.cache').rstrip('/')
+        return f'{xdg_cache_home}/trashy_rm/config.cache'
+
+    @classmethod
+    @functools.lru_cache(maxsize=1)
     def get_shredder(cls) -> str:
+        import shutil
         # File shredding
-        if call('hash shred 2>/dev/null', shell=True) == 0:
-            shredder = 'shred'
-        elif call('hash gshred 2>/dev/null', shell=True) == 0:
-            shredder = 'gshred'
-        else:
-            shredder = None
-        return shredder
+        shredder = shutil.which('shred') or shutil.which('gshred')
+        return os.path.basename(shredder) if shredder else None
 
     def get_trash_dir(self, target):
         """Get the best matching trash directory for the target file / dir"""
         raise NotImplementedError()
 
 
+@functools.lru_cache(maxsize=1)
 def get_system_info():
-    system_type = platform.system()
-    if system_type == 'Linux':
+    system_type = sys.platform
+    if system_type.startswith('linux'):
         return LinuxSystemInfo()
-    elif system_type == 'Darwin':
+    elif system_type == 'darwin':
         # TODO: get support from someone with an Apple Macintosh
         raise UnsupportedSystemError("Support for Darwin systems not implemented")
     else:
@@ -255,6 +532,9 @@ def run(sys_info, conf: AppConfig, opts: ExecConfig,
     if opts.help:
         out.write(__doc__)
         return 0
+    elif opts.get_trash:
+        out.write(sys_info.user_trash + '\n')
+        return 0
     else:
         raise NotImplementedError()
 
@@ -262,9 +542,15 @@ def run(sys_info, conf: AppConfig, opts: ExecConfig,
 def main() -> int:
     """trashy_rm run harness"""
     # TODO: handle and test exceptions
+    opts = parse_opts(sys.argv[1:])
+    if opts.help:
+        # Help needs neither the system info nor the app config
+        return run(None, AppConfig(), opts)
     sys_info = get_system_info()
-    opts = parse_opts(sys.argv)
-    conf = load_app_config(sys_info.configs)
+    if opts.get_trash:
+        return run(sys_info, AppConfig(), opts)
+    # A dry run must not modify the file system, including the config cache
+    conf = load_app_config(sys_info.configs, sys_info.config_cache, update_cache=not opts.dry_run)
     return run(sys_info, conf, opts)
 
 